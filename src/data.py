@@ -1,16 +1,22 @@
 """Defines models and functions for loading, manipulating, and writing task data"""
 from typing import Optional, List
-import re
+import os
 import random
-from functools import reduce
-from datasets import Dataset, DatasetDict
-import torch
+from collections import Counter
+from itertools import chain
+from datasets import Dataset, DatasetDict, Features, Sequence, Value
+import numpy as np
 import pandas as pd
 from tokenizer import morpheme_tokenize_no_punc as tokenizer, WordLevelTokenizer
 
 
 special_chars = ["[UNK]", "[SEP]", "[PAD]", "[MASK]"]
 
+# Morphology hierarchy table, loaded once at import
+morphology_table = pd.read_csv(os.path.join(os.path.dirname(__file__), 'uspanteko_morphology.csv'))
+gloss_to_levels = {row[0]: row[1:] for row in morphology_table.itertuples(index=False)}
+num_hierarchy_levels = morphology_table.shape[1]
+
 
 class IGTLine:
     """A single line of IGT"""
@@ -33,11 +39,14 @@ class IGTLine:
         if not segmented:
             return self.glosses.split()
         else:
-            words = re.split("\s+", self.glosses)
-            glosses = [re.split("-", word) for word in words]
-            glosses = [[gloss for gloss in word_glosses if gloss != ''] for word_glosses in glosses] # Remove empty glosses introduced by faulty segmentation
-            glosses = [word_glosses for word_glosses in glosses if word_glosses != []]
-            glosses = reduce(lambda a,b: a + ['[SEP]'] + b, glosses) # Add separator for word boundaries
+            glosses = []
+            for word in self.glosses.split():
+                word_glosses = [gloss for gloss in word.split('-') if gloss != ''] # Remove empty glosses introduced by faulty segmentation
+                if word_glosses == []:
+                    continue
+                if glosses:
+                    glosses.append('[SEP]') # Add separator for word boundaries
+                glosses.extend(word_glosses)
             return glosses
 
     def morphemes(self) -> Optional[List[str]]:
@@ -60,29 +69,26 @@ class IGTLine:
 def load_data_file(path: str) -> List[IGTLine]:
     """Loads a file containing IGT data into a list of entries."""
     all_data = []
+    prefix_to_field = {'\\t': 0, '\\m': 1, '\\p': 2, '\\l': 3}
 
-    with open(path, 'r') as file:
+    with open(path, 'r', buffering=1 << 20) as file:
         current_entry = [None, None, None, None]  # transc, segm, gloss, transl
 
-        for line in file:
+        for line in file.read().split('\n'):
             # Determine the type of line
             # If we see a type that has already been filled for the current entry, something is wrong
-            line_prefix = line[:2]
-            if line_prefix == '\\t' and current_entry[0] == None:
-                current_entry[0] = line[3:].strip()
-            elif line_prefix == '\\m' and current_entry[1] == None:
-                current_entry[1] = line[3:].strip()
-            elif line_prefix == '\\p' and current_entry[2] == None:
-                if len(line[3:].strip()) > 0:
-                    current_entry[2] = line[3:].strip()
-            elif line_prefix == '\\l' and current_entry[3] == None:
-                current_entry[3] = line[3:].strip()
-                # Once we have the translation, we've reached the end and can save this entry
-                all_data.append(IGTLine(transcription=current_entry[0],
-                                        segmentation=current_entry[1],
-                                        glosses=current_entry[2],
-                                        translation=current_entry[3]))
-                current_entry = [None, None, None, None]
+            field = prefix_to_field.get(line[:2])
+            if field is not None and current_entry[field] is None:
+                content = line[3:].strip()
+                if field != 2 or len(content) > 0:
+                    current_entry[field] = content
+                if field == 3:
+                    # Once we have the translation, we've reached the end and can save this entry
+                    all_data.append(IGTLine(transcription=current_entry[0],
+                                            segmentation=current_entry[1],
+                                            glosses=current_entry[2],
+                                            translation=current_entry[3]))
+                    current_entry = [None, None, None, None]
             elif line.strip() != "":
                 # Something went wrong
                 continue
@@ -105,25 +111,20 @@ def load_data_file(path: str) -> List[IGTLine]:
 special_chars = ["[UNK]", "[SEP]", "[PAD]", "[MASK]"]
 
 
+special_chars_set = frozenset(special_chars)
+
+
 def create_vocab(sentences: List[List[str]], threshold=2, should_not_lower=False):
     """Creates a set of the unique words in a list of sentences, only including words that exceed the threshold"""
-    all_words = dict()
+    all_words = Counter()
     for sentence in sentences:
         if sentence is None:
             continue
-        for word in sentence:
-            # Grams should stay uppercase, stems should be lowered
-            if not word.isupper() and not should_not_lower:
-                word = word.lower()
-            if word not in special_chars:
-                all_words[word] = all_words.get(word, 0) + 1
-
-    all_words_list = []
-    for word, count in all_words.items():
-        if count >= threshold:
-            all_words_list.append(word)
+        # Grams should stay uppercase, stems should be lowered
+        all_words.update(word if (word.isupper() or should_not_lower) else word.lower()
+                         for word in sentence if word not in special_chars_set)
 
-    return sorted(all_words_list)
+    return sorted(word for word, count in all_words.items() if count >= threshold)
 
 
 def create_gloss_vocab(morphology):
@@ -139,92 +140,123 @@ def create_gloss_vocab(morphology):
     return parse_tree(morphology)
 
 
-def prepare_dataset_mlm(data: List[List[str]], tokenizer: WordLevelTokenizer, device):
+def create_igt_dataset(data: List[IGTLine]) -> Dataset:
+    """Builds a columnar dataset from IGT lines, skipping the per-row dict round-trip through Arrow"""
+    columns = {'morphemes': [line.morphemes() for line in data]}
+    features = {'morphemes': Sequence(Value('string'))}
+    if all(line.glosses is not None for line in data):
+        columns['glosses'] = [line.gloss_list(segmented=line.should_segment) for line in data]
+        features['glosses'] = Sequence(Value('string'))
+    return Dataset.from_dict(columns, features=Features(features))
+
+
+def batch_convert_tokens_to_ids(batch_tokens: List[List[str]], tokenizer: WordLevelTokenizer) -> List[np.ndarray]:
+    """Converts a batch of token lists with a single tokenizer call, splitting the flat ids back by length"""
+    lengths = np.cumsum([len(tokens) for tokens in batch_tokens])
+    flat_ids = tokenizer.convert_tokens_to_ids(list(chain.from_iterable(batch_tokens)))
+    return np.split(np.asarray(flat_ids, dtype=np.int64), lengths[:-1])
+
+
+def prepare_dataset_mlm(data: List[List[str]], tokenizer: WordLevelTokenizer, cache_file_name: Optional[str] = None):
     """Encodes, pads, and creates attention mask for input. Also masks tokens and sets labels according"""
 
     # Create a dataset
     raw_dataset = Dataset.from_list([{'tokens': line} for line in data])
 
-    def process(row):
-        source_enc = tokenizer.convert_tokens_to_ids(row['tokens'])
+    def process(batch):
+        return { 'input_ids': batch_convert_tokens_to_ids(batch['tokens'], tokenizer) }
 
-        # Encode the output, if present
-        return { 'input_ids': torch.tensor(source_enc, dtype=torch.long).to(device) }
+    if cache_file_name is not None:
+        os.makedirs(os.path.dirname(cache_file_name), exist_ok=True)
+    dataset = raw_dataset.map(process, batched=True, batch_size=1000, num_proc=os.cpu_count(),
+                              remove_columns=raw_dataset.column_names,
+                              load_from_cache_file=True, cache_file_name=cache_file_name)
+    return dataset.with_format("torch", columns=['input_ids'])
 
-    return raw_dataset.map(process)
 
-
-def prepare_dataset(data: List[IGTLine], tokenizer: WordLevelTokenizer, labels: list[str], device):
+def prepare_dataset(data: List[IGTLine], tokenizer: WordLevelTokenizer, labels: list[str], cache_file_name: Optional[str] = None):
     """Encodes and pads inputs and creates attention mask"""
 
     # Create a dataset
-    raw_dataset = Dataset.from_list([line.__dict__() for line in data])
+    raw_dataset = create_igt_dataset(data)
+
+    # Hash lookup instead of a linear list.index scan per gloss
+    label_to_id = {label: index for index, label in enumerate(labels)}
 
-    def process(row):
-        source_enc = tokenizer.convert_tokens_to_ids(row['morphemes'])
+    def process(batch):
+        ids_list = batch_convert_tokens_to_ids(batch['morphemes'], tokenizer)
 
-        # Pad
-        initial_length = len(source_enc)
-        source_enc += [tokenizer.PAD_ID] * (tokenizer.model_max_length - initial_length)
+        # Pad and create attention masks with one array fill per batch
+        batch_input_ids = np.full((len(ids_list), tokenizer.model_max_length), tokenizer.PAD_ID, dtype=np.int64)
+        batch_attention_mask = np.zeros((len(ids_list), tokenizer.model_max_length), dtype=np.int64)
+        for i, ids in enumerate(ids_list):
+            batch_input_ids[i, :len(ids)] = ids
+            batch_attention_mask[i, :len(ids)] = 1
 
-        # Create attention mask
-        attention_mask = [1] * initial_length + [0] * (tokenizer.model_max_length - initial_length)
+        encoded = {'input_ids': batch_input_ids, 'attention_mask': batch_attention_mask}
 
         # Encode the output, if present
-        if 'glosses' in row:
+        if 'glosses' in batch:
             # For token class., the labels are just the glosses for each word
-            output_enc = [labels.index(gloss) for gloss in row['glosses']]
-            output_enc += [-100] * (tokenizer.model_max_length - len(output_enc))
-            return { 'input_ids': torch.tensor(source_enc, dtype=torch.long).to(device),
-                     'attention_mask': torch.tensor(attention_mask).to(device),
-                     'labels': torch.tensor(output_enc, dtype=torch.long).to(device)}
+            batch_labels = np.full((len(ids_list), tokenizer.model_max_length), -100, dtype=np.int64)
+            for i, glosses in enumerate(batch['glosses']):
+                batch_labels[i, :len(glosses)] = [label_to_id[gloss] for gloss in glosses]
+            encoded['labels'] = batch_labels
 
-        else:
-            # If we have no glosses, this must be a prediction task
-            return { 'input_ids': torch.tensor(source_enc).to(device),
-                     'attention_mask': torch.tensor(attention_mask).to(device)}
+        return encoded
 
-    return raw_dataset.map(process)
+    if cache_file_name is not None:
+        os.makedirs(os.path.dirname(cache_file_name), exist_ok=True)
+    dataset = raw_dataset.map(process, batched=True, batch_size=1000, num_proc=os.cpu_count(),
+                              remove_columns=raw_dataset.column_names,
+                              load_from_cache_file=True, cache_file_name=cache_file_name)
+    return dataset.with_format("torch")
 
 
-def prepare_multitask_dataset(data: List[IGTLine], tokenizer: WordLevelTokenizer, labels: list[str], device):
+def prepare_multitask_dataset(data: List[IGTLine], tokenizer: WordLevelTokenizer, labels: list[str], cache_file_name: Optional[str] = None):
     """Encodes and pads inputs and creates attention mask"""
 
     # Create a dataset
-    raw_dataset = Dataset.from_list([line.__dict__() for line in data])
+    raw_dataset = create_igt_dataset(data)
 
-    morphology = pd.read_csv('./uspanteko_morphology.csv')
+    # Precompute a dense label id -> hierarchy levels table, so each row is a single gather
+    # rather than a pandas scan per gloss per level
+    label_to_id = {label: index for index, label in enumerate(labels)}
+    hierarchy = np.zeros((len(labels), num_hierarchy_levels), dtype=np.int64)
+    for label, label_id in label_to_id.items():
+        hierarchy[label_id, 0] = label_id
+        hierarchy[label_id, 1:] = gloss_to_levels[label]
 
-    def process(row):
-        source_enc = tokenizer.convert_tokens_to_ids(row['morphemes'])
+    def process(batch):
+        ids_list = batch_convert_tokens_to_ids(batch['morphemes'], tokenizer)
 
-        # Pad
-        initial_length = len(source_enc)
-        source_enc += [tokenizer.PAD_ID] * (tokenizer.model_max_length - initial_length)
+        # Pad and create attention masks with one array fill per batch
+        batch_input_ids = np.full((len(ids_list), tokenizer.model_max_length), tokenizer.PAD_ID, dtype=np.int64)
+        batch_attention_mask = np.zeros((len(ids_list), tokenizer.model_max_length), dtype=np.int64)
+        for i, ids in enumerate(ids_list):
+            batch_input_ids[i, :len(ids)] = ids
+            batch_attention_mask[i, :len(ids)] = 1
 
-        # Create attention mask
-        attention_mask = [1] * initial_length + [0] * (tokenizer.model_max_length - initial_length)
+        encoded = {'input_ids': batch_input_ids, 'attention_mask': batch_attention_mask}
 
         # Encode the output, if present
-        if 'glosses' in row:
-            all_labels_enc = []
-
-            # Create labels for every level of hierarchy in the morphology
-            for level in range(morphology.shape[1]):
-                if level == 0:
-                    output_enc = [labels.index(gloss) for gloss in row['glosses']]
-                else:
-                    output_enc = [morphology[morphology['Gloss'] == gloss].iloc[0, level] for gloss in row['glosses']]
-                output_enc += [-100] * (tokenizer.model_max_length - len(output_enc))
-                all_labels_enc.append(torch.tensor(output_enc, dtype=torch.long))
-
-            return { 'input_ids': torch.tensor(source_enc, dtype=torch.long).to(device),
-                     'attention_mask': torch.tensor(attention_mask).to(device),
-                     'labels': torch.stack(all_labels_enc).to(device)}
-
-        else:
-            # If we have no glosses, this must be a prediction task
-            return { 'input_ids': torch.tensor(source_enc).to(device),
-                     'attention_mask': torch.tensor(attention_mask).to(device)}
-
-    return raw_dataset.map(process)
\ No newline at end of file
+        if 'glosses' in batch:
+            batch_labels = []
+            for glosses in batch['glosses']:
+                label_ids = np.fromiter((label_to_id[gloss] for gloss in glosses), dtype=np.int64, count=len(glosses))
+
+                # Gather labels for every level of hierarchy in the morphology at once, padding with -100
+                all_labels_enc = np.full((num_hierarchy_levels, tokenizer.model_max_length), -100, dtype=np.int64)
+                all_labels_enc[:, :len(glosses)] = hierarchy[label_ids].T
+
+                batch_labels.append(all_labels_enc)
+            encoded['labels'] = batch_labels
+
+        return encoded
+
+    if cache_file_name is not None:
+        os.makedirs(os.path.dirname(cache_file_name), exist_ok=True)
+    dataset = raw_dataset.map(process, batched=True, batch_size=1000, num_proc=os.cpu_count(),
+                              remove_columns=raw_dataset.column_names,
+                              load_from_cache_file=True, cache_file_name=cache_file_name)
+    return dataset.with_format("torch")
\ No newline at end of file
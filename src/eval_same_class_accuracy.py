@@ -14,7 +14,7 @@ from finetune_token_classifier import create_trainer
 device = "cuda:0" if torch.cuda.is_available() else "cpu"
 
 
-def eval_model(seed, all_glosses, train_data, dataset, tokenizer):
+def eval_model(seed, all_glosses, train_data, dev_data, dataset, tokenizer):
     # Create a set of the morphemes and glosses that were seen in the training data
     random.seed(seed)
     train_data = random.sample(train_data, 10)
@@ -47,8 +47,10 @@ def eval_model(seed, all_glosses, train_data, dataset, tokenizer):
         row = dataset['dev'][row_index]
         pred_row = preds[0][row_index]
 
-        for token_index in range(len(row['morphemes'])):
-            morpheme = row['morphemes'][token_index]
+        # The prepared dataset only keeps the encoded columns, so take the morphemes from the raw data
+        morphemes = dev_data[row_index].morphemes()
+        for token_index in range(len(morphemes)):
+            morpheme = morphemes[token_index]
             correct_label_index = row['labels'][token_index]
             predicted_label_index = pred_row[token_index]
 
@@ -90,12 +92,12 @@ def main():
     all_glosses = create_gloss_vocab(morphology)
 
     dataset = DatasetDict()
-    dataset['train'] = prepare_dataset(data=train_data, tokenizer=tokenizer, labels=all_glosses, device=device)
-    dataset['dev'] = prepare_dataset(data=dev_data, tokenizer=tokenizer, labels=all_glosses, device=device)
+    dataset['train'] = prepare_dataset(data=train_data, tokenizer=tokenizer, labels=all_glosses)
+    dataset['dev'] = prepare_dataset(data=dev_data, tokenizer=tokenizer, labels=all_glosses)
 
     all_results = []
     for seed in range(1, 21):
-        all_results.append(eval_model(seed, all_glosses, train_data, dataset, tokenizer))
+        all_results.append(eval_model(seed, all_glosses, train_data, dev_data, dataset, tokenizer))
 
     df = pd.DataFrame(all_results)
     df.to_csv('same_class_accuracy.csv')
@@ -18,8 +18,8 @@ tokenizer = WordLevelTokenizer(vocab=train_vocab, model_max_length=64)
 glosses = create_gloss_vocab(morphology)
 
 dataset = DatasetDict()
-dataset['train'] = prepare_dataset(data=train_data, tokenizer=tokenizer, labels=glosses, device='cpu')
-dataset['dev'] = prepare_dataset(data=dev_data, tokenizer=tokenizer, labels=glosses, device='cpu')
+dataset['train'] = prepare_dataset(data=train_data, tokenizer=tokenizer, labels=glosses)
+dataset['dev'] = prepare_dataset(data=dev_data, tokenizer=tokenizer, labels=glosses)
 
 
 def compute_metrics(eval_preds):
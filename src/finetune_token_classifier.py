@@ -17,7 +17,7 @@ from multistage_model import MultistageModel
 device = "cuda:0" if torch.cuda.is_available() else "cpu"
 
 
-def create_trainer(model: RobertaForTokenClassification, dataset: Optional[DatasetDict], tokenizer: WordLevelTokenizer, labels: List[str], batch_size, max_epochs, report_to):
+def create_trainer(model: RobertaForTokenClassification, dataset: Optional[DatasetDict], tokenizer: WordLevelTokenizer, labels: List[str], batch_size, max_epochs, grad_accum=1, report_to="none"):
     print("Creating trainer...")
 
     def compute_metrics(eval_preds):
@@ -54,7 +54,7 @@ def create_trainer(model: RobertaForTokenClassification, dataset: Optional[Datas
         evaluation_strategy="epoch",
         per_device_train_batch_size=batch_size,
         per_device_eval_batch_size=batch_size,
-        gradient_accumulation_steps=3,
+        gradient_accumulation_steps=grad_accum,
         weight_decay=0.01,
         save_strategy="epoch",
         save_total_limit=3,
@@ -62,6 +62,13 @@ def create_trainer(model: RobertaForTokenClassification, dataset: Optional[Datas
         load_best_model_at_end=True,
         logging_strategy='epoch',
         report_to=report_to,
+        dataloader_pin_memory=True,
+        dataloader_num_workers=max(4, os.cpu_count() // 2),
+        dataloader_persistent_workers=True,
+        bf16=torch.cuda.is_available() and torch.cuda.is_bf16_supported(),
+        fp16=torch.cuda.is_available() and not torch.cuda.is_bf16_supported(),
+        tf32=(torch.cuda.is_available() and torch.cuda.get_device_capability()[0] >= 8) or None,
+        torch_compile=torch.cuda.is_available(),
     )
 
     trainer = Trainer(
@@ -86,9 +93,10 @@ def cli():
 # @click.option('--loss_sum', type=click.Choice(['linear', 'harmonic'], case_sensitive=False))
 @click.option("--train_size", help="Number of items to sample from the training data", type=int)
 @click.option("--seed", help="Random seed", type=int)
-def train(train_size: int, type: bool, seed: int):
+@click.option("--batch_size", help="Per-device batch size", type=int, default=64)
+@click.option("--grad_accum", help="Gradient accumulation steps", type=int, default=1)
+def train(train_size: int, type: bool, seed: int, batch_size: int, grad_accum: int):
     MODEL_INPUT_LENGTH = 64
-    BATCH_SIZE = 64
     EPOCHS = 30
 
     run_name = f"{train_size if train_size else 'full'}-{type}-{seed}"
@@ -117,12 +125,17 @@ def train(train_size: int, type: bool, seed: int):
 
     dataset = DatasetDict()
 
+    cache_suffix = f"{train_size if train_size else 'full'}-{seed}"
     if type == 'flat':
-        dataset['train'] = prepare_dataset(data=train_data, tokenizer=tokenizer, labels=glosses, device=device)
-        dataset['dev'] = prepare_dataset(data=dev_data, tokenizer=tokenizer, labels=glosses, device=device)
+        dataset['train'] = prepare_dataset(data=train_data, tokenizer=tokenizer, labels=glosses,
+                                           cache_file_name=f"../cache/flat-train-{cache_suffix}.arrow")
+        dataset['dev'] = prepare_dataset(data=dev_data, tokenizer=tokenizer, labels=glosses,
+                                         cache_file_name=f"../cache/flat-dev.arrow")
     else:
-        dataset['train'] = prepare_multitask_dataset(data=train_data, tokenizer=tokenizer, labels=glosses, device=device)
-        dataset['dev'] = prepare_multitask_dataset(data=dev_data, tokenizer=tokenizer, labels=glosses, device=device)
+        dataset['train'] = prepare_multitask_dataset(data=train_data, tokenizer=tokenizer, labels=glosses,
+                                                     cache_file_name=f"../cache/multitask-train-{cache_suffix}.arrow")
+        dataset['dev'] = prepare_multitask_dataset(data=dev_data, tokenizer=tokenizer, labels=glosses,
+                                                   cache_file_name=f"../cache/multitask-dev.arrow")
 
     # if loss == "flat":
     #     model = AutoModelForTokenClassification.from_pretrained("michaelginn/uspanteko-mlm-large", num_labels=len(glosses))
@@ -138,7 +151,7 @@ def train(train_size: int, type: bool, seed: int):
         else:
             model = AutoModelForTokenClassification.from_pretrained("michaelginn/uspanteko-mlm-large", num_labels=len(glosses))
 
-        trainer = create_trainer(model, dataset=dataset, tokenizer=tokenizer, labels=glosses, batch_size=BATCH_SIZE, max_epochs=EPOCHS, report_to='wandb')
+        trainer = create_trainer(model, dataset=dataset, tokenizer=tokenizer, labels=glosses, batch_size=batch_size, grad_accum=grad_accum, max_epochs=EPOCHS, report_to='wandb')
         trainer.train()
     else:
         # Train in multiple stages
@@ -146,8 +159,8 @@ def train(train_size: int, type: bool, seed: int):
 
         for stage in [3, 2, 1, 0]:
             model.current_stage = stage
-            trainer = create_trainer(model, dataset=dataset, tokenizer=tokenizer, labels=glosses, batch_size=BATCH_SIZE,
-                                     max_epochs=EPOCHS, report_to='wandb' if stage == 0 else "none")
+            trainer = create_trainer(model, dataset=dataset, tokenizer=tokenizer, labels=glosses, batch_size=batch_size,
+                                     grad_accum=grad_accum, max_epochs=EPOCHS, report_to='wandb' if stage == 0 else "none")
             trainer.train()
 
     trainer.save_model(f'../models/{run_name}')
@@ -2,6 +2,7 @@ import click
 import wandb
 import torch
 import math
+import os
 from transformers import RobertaConfig, TrainingArguments, Trainer, RobertaForMaskedLM, DataCollatorForLanguageModeling
 from datasets import DatasetDict
 from data import load_data_file, prepare_dataset_mlm
@@ -13,9 +14,11 @@ device = "cuda:0" if torch.cuda.is_available() else "cpu"
 
 @click.command()
 @click.option("--arch_size", type=str)
-def train(arch_size: str='micro'):
+@click.option("--batch_size", type=int, default=64)
+@click.option("--grad_accum", type=int, default=1)
+def train(arch_size: str='micro', batch_size: int=64, grad_accum: int=1):
     MODEL_INPUT_LENGTH = 64
-    BATCH_SIZE = 64
+    BATCH_SIZE = batch_size
     EPOCHS = 200
 
     wandb.init(project="taxo-morph-pretrain", entity="michael-ginn", config={
@@ -35,8 +38,10 @@ def train(arch_size: str='micro'):
     tokenizer = WordLevelTokenizer(vocab=train_vocab, model_max_length=MODEL_INPUT_LENGTH)
 
     dataset = DatasetDict()
-    dataset['train'] = prepare_dataset_mlm(data=[line.morphemes() for line in train_data], tokenizer=tokenizer, device=device)
-    dataset['dev'] = prepare_dataset_mlm(data=[line.morphemes() for line in dev_data], tokenizer=tokenizer, device=device)
+    dataset['train'] = prepare_dataset_mlm(data=[line.morphemes() for line in train_data], tokenizer=tokenizer,
+                                           cache_file_name="../cache/mlm-train.arrow")
+    dataset['dev'] = prepare_dataset_mlm(data=[line.morphemes() for line in dev_data], tokenizer=tokenizer,
+                                         cache_file_name="../cache/mlm-dev.arrow")
 
     data_collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm_probability=0.15, return_tensors="pt")
 
@@ -62,12 +67,19 @@ def train(arch_size: str='micro'):
         evaluation_strategy="epoch",
         per_device_train_batch_size=BATCH_SIZE,
         per_device_eval_batch_size=BATCH_SIZE,
-        gradient_accumulation_steps=3,
+        gradient_accumulation_steps=grad_accum,
         weight_decay=0.01,
         save_strategy="epoch",
         save_total_limit=3,
         num_train_epochs=EPOCHS,
         report_to="wandb",
+        dataloader_pin_memory=True,
+        dataloader_num_workers=max(4, os.cpu_count() // 2),
+        dataloader_persistent_workers=True,
+        bf16=torch.cuda.is_available() and torch.cuda.is_bf16_supported(),
+        fp16=torch.cuda.is_available() and not torch.cuda.is_bf16_supported(),
+        tf32=(torch.cuda.is_available() and torch.cuda.get_device_capability()[0] >= 8) or None,
+        torch_compile=torch.cuda.is_available(),
     )
     trainer = Trainer(
         model=language_model,
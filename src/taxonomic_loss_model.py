@@ -4,9 +4,6 @@ from transformers import RobertaModel, BertConfig, RobertaForTokenClassification
 from transformers.modeling_outputs import TokenClassifierOutput
 from typing import Optional, Union, Tuple
 import numpy as np
-import pandas as pd
-
-device = "cuda:0" if torch.cuda.is_available() else "cpu"
 
 
 class TaxonomicLossModel(RobertaForTokenClassification):
@@ -17,7 +14,6 @@ class TaxonomicLossModel(RobertaForTokenClassification):
         self.num_labels = config.num_labels
 
         self.morphology = None
-        self.hierarchy_matrix = None
         self.max_depth = None
         self.loss_sum = loss_sum
 
@@ -33,9 +29,21 @@ class TaxonomicLossModel(RobertaForTokenClassification):
 
     def use_morphology_tree(self, tree, max_depth: int):
         self.morphology = tree
-        self.hierarchy_matrix = pd.DataFrame(self.get_hierarchy_matrix(self.morphology, self.num_labels, max_depth))
+        matrix = self.get_hierarchy_matrix(self.morphology, self.num_labels, max_depth)
+        self.register_buffer('hierarchy_matrix', torch.as_tensor(matrix, dtype=torch.long))
         self.max_depth = max_depth
 
+        # Precompute, for each level, a label -> group id table (for scatter-summing logits)
+        # and a label -> group id remap table with an extra ignored row for padding labels.
+        # Registered as buffers so .to(device) moves them along with the model
+        self.num_groups = []
+        for level in range(max_depth):
+            # Tags sharing a value at this level of the matrix belong to the same group
+            group_ids = torch.as_tensor(np.unique(matrix[:, level], return_inverse=True)[1], dtype=torch.long)
+            self.num_groups.append(int(group_ids.max()) + 1)
+            self.register_buffer(f'group_ids_{level}', group_ids)
+            self.register_buffer(f'label_map_{level}', torch.cat([group_ids, torch.tensor([-100])]))
+
     def get_hierarchy_matrix(self, hierarchy_tree, num_tags, max_depth):
         """Takes a hierarchical tree, and creates a matrix of a_i,j where i is the tag and j is the level of hierarchy.
         """
@@ -61,21 +69,21 @@ class TaxonomicLossModel(RobertaForTokenClassification):
 
 
     def taxonomic_loss(self, logits, labels):
-        labels[labels == -100] = 66
+        # Remap padding labels to the extra (ignored) row of the remap tables,
+        # without mutating the caller's tensor
+        safe_labels = labels.masked_fill(labels.eq(-100), self.num_labels)
         loss_fct = nn.CrossEntropyLoss()
 
         all_loss = None
 
         for level in range(self.max_depth):
-            # Create groups for this level of hierarchy with indices
-            groups = list(self.hierarchy_matrix.groupby(by=level).groups.values())
-
-            # For each group, sum the logits for all items
-            group_logits = torch.transpose(torch.stack([logits[:,group].sum(axis=1) for group in groups]), 0, 1)
+            # For each group at this level, sum the logits for all items with a single scatter-add
+            group_ids = getattr(self, f'group_ids_{level}')
+            group_logits = torch.zeros(logits.shape[0], self.num_groups[level], dtype=logits.dtype, device=logits.device)
+            group_logits.scatter_add_(1, group_ids.expand(logits.shape[0], -1), logits)
 
-            # Use the hierarchy matrix to turn node labels into group labels
-            group_labels = np.vstack([self.hierarchy_matrix, [-100] * self.hierarchy_matrix.shape[1]])[labels.cpu(), level]
-            group_labels = torch.tensor(group_labels, dtype=torch.long).to(device)
+            # Use the precomputed remap table to turn node labels into group labels
+            group_labels = getattr(self, f'label_map_{level}').index_select(0, safe_labels)
 
             # Calculate crossentropy loss between group logits and group labels
             level_loss = loss_fct(group_logits, group_labels)
@@ -84,7 +92,6 @@ class TaxonomicLossModel(RobertaForTokenClassification):
                 divisor = self.max_depth - level
                 level_loss = torch.div(level_loss, divisor)
 
-            print("LEVEL", level, level_loss)
             if all_loss is not None:
                 all_loss += level_loss
             else:
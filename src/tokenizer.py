@@ -1,17 +1,19 @@
 import re
 from abc import ABC
-from functools import reduce
 from transformers import PreTrainedTokenizer
 from typing import List, Dict, Optional, Tuple, Any
 
-word_regex = r"(?:[^.,!?;¿\s]|\?\?\?)+" # Matches any string not containing punctuation or whitespace
+word_regex = re.compile(r"(?:[^.,!?;¿\s]|\?\?\?)+") # Matches any string not containing punctuation or whitespace
 def morpheme_tokenize_no_punc(str: str):
     """Tokenizes by splitting into morphemes, skipping punctuation"""
-    words = re.findall(word_regex, str)
-    words = [word.split('-') for word in words]
-    words = [[morpheme for morpheme in word if morpheme != ''] for word in words]  # Remove empty morphemes introduced by faulty segmentation
-    words = [word for word in words if word != []]
-    morphemes = reduce(lambda a,b: a + ['[SEP]'] + b, words)
+    morphemes = []
+    for word in word_regex.findall(str):
+        word_morphemes = [morpheme for morpheme in word.split('-') if morpheme != '']  # Remove empty morphemes introduced by faulty segmentation
+        if word_morphemes == []:
+            continue
+        if morphemes:
+            morphemes.append('[SEP]')
+        morphemes.extend(word_morphemes)
     return morphemes
 
 
@@ -26,6 +28,7 @@ class WordLevelTokenizer(PreTrainedTokenizer):
         self.special_chars = ["[UNK]", "[SEP]", "[PAD]", "[MASK]"]
         self.vocab = vocab
         self.all_vocab = self.special_chars + self.vocab
+        self.token_to_id = {token: index for index, token in enumerate(self.all_vocab)}
 
         self.UNK_ID = self.special_chars.index("[UNK]")
         self.SEP_ID = self.special_chars.index("[SEP]")
@@ -57,7 +60,7 @@ class WordLevelTokenizer(PreTrainedTokenizer):
         raise NotImplementedError
 
     def _convert_token_to_id(self, token):
-        return self.all_vocab.index(token) if token in self.all_vocab else self.UNK_ID
+        return self.token_to_id.get(token, self.UNK_ID)
 
     def _convert_id_to_token(self, index: int) -> str:
         return self.all_vocab[index]